@@ -1,16 +1,22 @@
+import asyncio
 import importlib
+import logging
 from contextlib import asynccontextmanager
+from json import dumps
 from os import environ
+from typing import Any, Awaitable, Callable
 
 from databases import Database
 from fastapi import FastAPI, HTTPException, Request, Response
-from stripe import RateLimitError, StripeError
+from pydantic import ValidationError
+from stripe import StripeError
 
 from context import Context
 from lib.logging import setup_logging
 from lib.models import PubSubEvent, StripeEvent
 from lib.publisher import Publisher
 from lib.stripe import Stripe
+from lib.utils import MISSING
 
 
 # Prefer DATABASE_URI, but fall back to individual component env vars if necessary.
@@ -27,12 +33,81 @@ database = Database(db_uri)
 client = Stripe()
 publisher = Publisher()
 
+# Shared secret used to verify that Pub/Sub events were published by us. Read once at startup, like the Stripe credentials.
+pubsub_secret = environ.get("PUBSUB_SECRET")
+# The JSON-encoded secret, used when building Pub/Sub payloads.
+_pubsub_secret_json = dumps(pubsub_secret).encode("utf-8")
+
+# Event handlers keyed by event type, so each handler module is only loaded from disk once.
+# A string value means we already know there is no handler for that event type, and is the reason logged for it.
+_handler_cache: dict[str, Callable[[Context], Awaitable[Any]] | str] = {}
+
+# When no publisher is available, events are processed in-process by a pool of background workers fed from this queue.
+# This lets us ACK Stripe immediately rather than holding the request open while the handler runs.
+#
+# Each queued item is an event plus the number of attempts made so far.
+event_workers = int(environ.get("EVENT_WORKERS", "4"))
+_work_queue: asyncio.Queue[tuple[StripeEvent, int]] = asyncio.Queue(
+    maxsize=int(environ.get("EVENT_QUEUE_SIZE", "1000"))
+)
+
+# Because queued events have already been ACKed, Stripe will never retry them for us. Failed events are retried in-process with exponential backoff instead, and only dropped after this many attempts.
+event_max_attempts = int(environ.get("EVENT_MAX_ATTEMPTS", "5"))
+event_retry_delay = float(environ.get("EVENT_RETRY_DELAY", "1.0"))
+
+# Pending delayed re-queues, kept so shutdown can wait for them.
+_retry_tasks: set[asyncio.Task] = set()
+
+logger = logging.getLogger(__name__)
+
+
+# Puts a failed event back on the queue after a delay.
+async def requeue_event(event: StripeEvent, attempts: int, delay: float):
+    await asyncio.sleep(delay)
+    await _work_queue.put((event, attempts))
+
+
+# Processes queued events until cancelled.
+async def event_worker():
+    while True:
+        event, attempts = await _work_queue.get()
+        attempts += 1
+        extra = {"event_id": event.id, "event_type": event.type, "attempts": attempts}
+        try:
+            await process_event(event)
+        except Exception:
+            if attempts >= event_max_attempts:
+                logger.exception(
+                    "Failed to process queued event, giving up", extra=extra
+                )
+            else:
+                delay = event_retry_delay * 2 ** (attempts - 1)
+                logger.warning(
+                    f"Failed to process queued event, retrying in {delay}s",
+                    extra=extra,
+                    exc_info=True,
+                )
+                task = asyncio.create_task(requeue_event(event, attempts, delay))
+                _retry_tasks.add(task)
+                task.add_done_callback(_retry_tasks.discard)
+        finally:
+            _work_queue.task_done()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     setup_logging()
     await database.connect()
+    workers = [asyncio.create_task(event_worker()) for _ in range(event_workers)]
     yield
+    # Finish any events we've already ACKed (including pending retries) before shutting down.
+    await _work_queue.join()
+    while _retry_tasks:
+        await asyncio.gather(*_retry_tasks)
+        await _work_queue.join()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
     await database.disconnect()
 
 
@@ -40,26 +115,38 @@ app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/receive")
-async def webhook(event: StripeEvent, request: Request):
+async def webhook(request: Request):
     # Verify the event request signature first.
+    # The raw body is read once and used for both signature verification and parsing the event.
+    body = await request.body()
     signature = request.headers.get("Stripe-Signature", "")
-    payload = (await request.body()).decode("utf-8")
-    if not client.verify_signature(signature, payload):
+    if not client.verify_signature(signature, body):
         return Response(status_code=401)
 
-    # If we don't have a publisher, process the event synchronously.
+    try:
+        event = StripeEvent.model_validate_json(body)
+    except ValidationError:
+        return Response(status_code=422)
+
+    # If we don't have a publisher, hand the event to our in-process workers and ACK immediately.
+    # If the queue is full, ask Stripe to back off and retry later.
     if not publisher.is_connected or not publisher.default_topic:
-        return await process_event(event)
+        try:
+            _work_queue.put_nowait((event, 0))
+        except asyncio.QueueFull:
+            return Response(status_code=429)
+        return Response(status_code=202)
 
     # Otherwise, queue the event via the publisher for asynchronous processing.
-    payload = {"secret": environ.get("PUBSUB_SECRET"), "event": event.model_dump()}
+    # The verified request body is already a valid JSON event, so it is spliced into the envelope as-is rather than re-serialized.
+    payload = b'{"secret":' + _pubsub_secret_json + b',"event":' + body + b"}"
     await publisher.publish(payload)
 
 
 @app.post("/pubsub")
 async def pubsub(pubsub_event: PubSubEvent):
     # Verify the event secret first.
-    if pubsub_event.secret != environ.get("PUBSUB_SECRET"):
+    if pubsub_event.secret != pubsub_secret:
         # We ACK the event even if it's not valid, to prevent it from re-sending.
         return Response(status_code=204)
 
@@ -70,7 +157,6 @@ async def pubsub(pubsub_event: PubSubEvent):
 async def process_event(event: StripeEvent):
     # Create an event context to pass to the handler.
     ctx = Context(database=database, stripe=client, event=event)
-    fun = None
 
     # All event types are dot-deliminted module paths + function names.
     # e.g. event type `customer.subscription.created` maps to:
@@ -79,52 +165,60 @@ async def process_event(event: StripeEvent):
     #   - Function `created`
     # So we import `events.customer.subscription` from `events/customer/subscription.py` and then call `created(ctx)` on the module.
     # It is assumed that all imported functions are async and will be awaited when called.
-    parts = event.type.split(".")
-    fname = parts.pop()
+    fun = _handler_cache.get(event.type, MISSING)
+
+    if fun is MISSING:
+        parts = event.type.split(".")
+        fname = parts.pop()
+
+        # No lock is needed around the import: nothing below awaits, so no other event can interleave on the event loop.
+        try:
+            # Because some "packages" might be named the same as some "modules"...
+            # We use `spec_from_file_location` and `module_from_spec` to load the module from a known file path pattern.
+            spec = importlib.util.spec_from_file_location(  # pyright: ignore[reportAttributeAccessIssue]
+                f"events.{'.'.join(parts)}", f"events/{'/'.join(parts)}.py"
+            )
+            module = importlib.util.module_from_spec(  # pyright: ignore[reportAttributeAccessIssue]
+                spec
+            )
 
-    try:
-        # Because some "packages" might be named the same as some "modules"...
-        # We use `spec_from_file_location` and `module_from_spec` to load the module from a known file path pattern.
-        spec = importlib.util.spec_from_file_location(  # pyright: ignore[reportAttributeAccessIssue]
-            f"events.{'.'.join(parts)}", f"events/{'/'.join(parts)}.py"
-        )
-        module = importlib.util.module_from_spec(  # pyright: ignore[reportAttributeAccessIssue]
-            spec
-        )
-
-        # Will throw a `FileNotFoundError` if we just don't have a file/module for this event object.
-        spec.loader.exec_module(module)
-
-        # Will throw an `AttributeError` if we don't have a function for this event type.
-        fun = getattr(module, fname)
-    # Notice that we only log the event if we don't have a handler for it. This is intentional.
-    # We want to ACK the event even if we don't have a handler for it yet, to prevent it from re-sending.
-    except FileNotFoundError:
-        ctx.warning(f"No event module for {event.type}", {"event_id": event.id})
+            # Will throw a `FileNotFoundError` if we just don't have a file/module for this event object.
+            spec.loader.exec_module(module)
+
+            # Will throw an `AttributeError` if we don't have a function for this event type.
+            fun = getattr(module, fname)
+        # Notice that we only log the event if we don't have a handler for it. This is intentional.
+        # We want to ACK the event even if we don't have a handler for it yet, to prevent it from re-sending.
+        except FileNotFoundError:
+            fun = f"No event module for {event.type}"
+        except AttributeError:
+            fun = f"No event handler for {event.type}"
+
+        _handler_cache[event.type] = fun
+
+    # There is no handler for this event type, either from the lookup above or a previous one.
+    if isinstance(fun, str):
+        ctx.warning(fun, {"event_id": event.id})
         return {"success": True}
-    except AttributeError:
-        ctx.warning(f"No event handler for {event.type}", {"event_id": event.id})
+
+    # Check if this event is newer than the last one we processed. If false, we've already processed a more recent occurence of this event.
+    if not (await ctx.check_webhook_tracker()):
         return {"success": True}
-    # If we get a Stripe 429, it means we're being rate-limited. We should retry the event later.
-    except RateLimitError as e:
-        ctx.warning(f"Rate-limited by Stripe", {"event_id": event.id, "error": str(e)})
-        raise HTTPException(status_code=429, detail="Rate-limited by Stripe")
+
+    # The event requires processing, so let's call the handler.
+    # This deliberately runs outside of any transaction, so that slow Stripe calls in a handler never hold a database connection or row lock.
+    # If any exceptions are raised at this point, the tracker is left untouched and the event will be retried later: by Pub/Sub redelivery, or by the in-process queue's own retries.
+    try:
+        await fun(ctx)
+    # If we get a Stripe 429 (`RateLimitError` or otherwise), it means we're being rate-limited. We should retry the event later.
+    # On the Pub/Sub path the 429 response triggers a redelivery. On the in-process queue path there is no response; the worker treats it as a failure and retries the event itself.
     except StripeError as e:
         if e.http_status == 429:
             ctx.warning(
                 f"Rate-limited by Stripe", {"event_id": event.id, "error": str(e)}
             )
             raise HTTPException(status_code=429, detail="Rate-limited by Stripe")
-
-    assert fun is not None
-
-    # Check if we can increment our webhook tracker. If false, we've already processed a more recent occurence of this event.
-    if not (await ctx.check_webhook_tracker()):
-        return {"success": True}
-
-    # The event requires processing, so let's call the handler.
-    # If any exceptions are raised at this point, that will ensure Stripe retries the event later.
-    await fun(ctx)
+        raise
 
     # Now we actually write the updated timestamp to the webhook tracker table.
     await ctx.increment_webhook_tracker()
@@ -1,16 +1,16 @@
 import logging
+from functools import cached_property
 from os import environ
 from typing import Any, TypeAlias
 from uuid import uuid4
 
-import asyncpg
 from databases import Database
 from pymongo import MongoClient
 from stripe import Customer, StripeObject, Subscription
 
 from lib.models import StripeEvent
 from lib.stripe import Stripe
-from lib.tables import _WebhookTracker, WebhookTrackers
+from lib.tables import SELECT_WEBHOOK_TRACKER, UPSERT_WEBHOOK_TRACKER
 
 
 # Type union defines a Customer OR Subscription, which we use frequently for accessing and setting user-related metadata.
@@ -18,6 +18,17 @@ CustomerOrSubscription: TypeAlias = Customer | Subscription
 
 logger = logging.getLogger(__name__)
 
+# A single MongoDB client shared by every context. `MongoClient` maintains its own connection pool and is safe for concurrent use.
+_mongo_client: MongoClient | None = None
+
+
+# Returns the shared MongoDB client, creating it on first use.
+def mongo_client() -> MongoClient:
+    global _mongo_client
+    if _mongo_client is None:
+        _mongo_client = MongoClient(environ.get("MONGO_URI", "mongodb://mongo:27017"))
+    return _mongo_client
+
 
 # A class that contains contextual resources for the application.
 class Context:
@@ -27,7 +38,12 @@ class Context:
         self.event = event
         self.stripe = stripe
         self.db = database
-        self.mongo = MongoClient(environ.get("MONGO_URI", "mongodb://mongo:27017"))
+        self.mongo = mongo_client()
+        # Extras attached to every log record for this event.
+        self._log_extras = {
+            "event_id": event.id,
+            "resource_id": event.data.object["id"],
+        }
 
     @property
     def logger(self):
@@ -35,21 +51,25 @@ class Context:
 
     def prepare_log_extras(self, extra: dict[str, Any] | None, /):
         extra = extra or {}
-        extra["event_id"] = self.event.id
-        extra["resource_id"] = self.resource["id"]
+        extra.update(self._log_extras)
         return extra
 
+    # Logs at the given level, skipping the extras preparation entirely if the level is disabled.
+    def log(self, level: int, msg: Any, extra: dict[str, Any] | None = None):
+        if logger.isEnabledFor(level):
+            logger.log(level, msg, extra=self.prepare_log_extras(extra))
+
     def debug(self, msg: Any, extra: dict[str, Any] | None = None):
-        logger.info(msg, extra=self.prepare_log_extras(extra))
+        self.log(logging.DEBUG, msg, extra)
 
     def info(self, msg: Any, extra: dict[str, Any] | None = None):
-        logger.info(msg, extra=self.prepare_log_extras(extra))
+        self.log(logging.INFO, msg, extra)
 
     def warning(self, msg: Any, extra: dict[str, Any] | None = None):
-        logger.info(msg, extra=self.prepare_log_extras(extra))
+        self.log(logging.WARNING, msg, extra)
 
     def error(self, msg: Any, extra: dict[str, Any] | None = None):
-        logger.info(msg, extra=self.prepare_log_extras(extra))
+        self.log(logging.ERROR, msg, extra)
 
     # Fetch the database connection.
     @property
@@ -64,62 +84,36 @@ class Context:
     def collection(self, database: str, name: str):
         return self.mdatabase(database)[name]
 
-    # Fetches the webhook tracker data for the current event, if any prior tracker info exists.
-    async def fetch_webhook_tracker(self) -> _WebhookTracker | None:
-        evt_id = self.event.data.object["id"]
-        evt_type = self.event.type
-
-        tracker = await self.db.fetch_one(
-            query="SELECT * FROM webhook_trackers WHERE event_id = :event_id AND event_type = :event_type",
-            values={"event_id": evt_id, "event_type": evt_type},
-        )
-
-        return tracker  # pyright: ignore [reportReturnType]  # databases is stupid and can't type this properly
-
     # Returns true if the event for this context is newer than the previous most recent event of the same type.
     async def check_webhook_tracker(self) -> bool:
-        t = await self.fetch_webhook_tracker()
-        if t is None:
-            return True
-        return t.updated < self.event.created
-
-    # Attempts to increment our webhook tracker. Returns the updated tracker info.
-    async def increment_webhook_tracker(self) -> None:
-        evt_id = self.event.data.object["id"]
-        evt_type = self.event.type
-
-        created = self.event.created
-        t = await self.fetch_webhook_tracker()
-
-        if t is None:
-            # Tracker doesn't exist, create a new tracker.
-            try:
-                values = {
-                    "id": uuid4(),
-                    "event_id": evt_id,
-                    "event_type": evt_type,
-                    "updated": created,
-                }
-                await self.db.execute(
-                    query=WebhookTrackers.insert(),
-                    values=values,
-                )
-            except asyncpg.exceptions.UniqueViolationError:
-                self.error(
-                    "Failed to record webhook tracker event.",
-                    {"event_type": evt_type},
-                )
-                raise RuntimeError("Failed to record webhook tracker event.")
-        else:
-            # Tracker does exist, update.
-            await self.db.execute(
-                query=WebhookTrackers.update().where(WebhookTrackers.c.id == t.id),
-                values={"updated": created},
-            )
-            t.updated = created
+        updated = await self.db.fetch_val(
+            query=SELECT_WEBHOOK_TRACKER.params(
+                event_id=self.event.data.object["id"], event_type=self.event.type
+            ),
+        )
+        return updated is None or updated < self.event.created
+
+    # Records this event in the webhook tracker, unless a more recent occurence of the same event has already been recorded.
+    #
+    # This should only be called once the event has been processed successfully, so that a failed handler leaves the tracker untouched and the event will be processed again on retry.
+    #
+    # The insert-or-advance happens in a single atomic upsert, so concurrent deliveries can't race each other or move the tracker backwards. Returns true if the tracker was created or advanced.
+    async def increment_webhook_tracker(self) -> bool:
+        row = await self.db.fetch_one(
+            query=UPSERT_WEBHOOK_TRACKER,
+            values={
+                "id": uuid4(),
+                "event_id": self.event.data.object["id"],
+                "event_type": self.event.type,
+                "updated": self.event.created,
+            },
+        )
 
-    # Get the resource associated with the event.
-    @property
+        # No row is returned when the conflicting tracker is already as new or newer than this event.
+        return row is not None
+
+    # Get the resource associated with the event. Constructed on first access and reused afterwards.
+    @cached_property
     def resource(self) -> StripeObject:
         return StripeObject.construct_from(
             values=self.event.data.object, key=self.stripe.client.api_key
@@ -1,3 +1,4 @@
+import asyncio
 from typing import Any, Dict, Optional
 
 from stripe import Customer, Invoice
@@ -7,17 +8,30 @@ from context import Context
 
 # invoice.paid
 async def paid(ctx: Context) -> None:
-    invoice: Invoice = Invoice.retrieve(ctx.resource["id"], expand=["customer"])
+    # The event payload already contains the full invoice, so there's no need to retrieve it again.
+    invoice = Invoice.construct_from(
+        values=ctx.event.data.object, key=ctx.stripe.client.api_key
+    )
 
     # Only process invoices for non-subscriptions right now (i.e. one-time credit purchases).
     # Subscription events should be handled via `customer.subscription.*` events.
     if invoice.subscription is None:
-        assert isinstance(invoice.customer, Customer)
-        user_id = ctx.get_user_id(invoice.customer)
+        # Invoices without a customer (e.g. guest checkouts) can't be mapped to a user.
+        customer = invoice.customer
+        if customer is None:
+            ctx.warning(f"Invoice {invoice.id} has no customer. Skipping.")
+            return
+
+        # Event payloads never expand the customer, so we only fetch the customer itself.
+        if not isinstance(customer, Customer):
+            # The Stripe client is synchronous, so run the request in a thread to avoid blocking the event loop.
+            async with ctx.stripe.limiter.slot():
+                customer = await asyncio.to_thread(Customer.retrieve, customer)
+        user_id = ctx.get_user_id(customer)
         if user_id is None:
             ctx.warning(
                 f"Unable to find user id for customer. Skipping.",
-                {"customer_id": invoice.customer.id},
+                {"customer_id": customer.id},
             )
             return
         await push_entitlements_from_line_items(ctx, user_id, invoice)
@@ -42,4 +56,3 @@ async def push_entitlements_from_line_items(
     # We would have some logic here to fetch entitlement data from the Stripe price ids via `ctx.database`.
     # Then, if we successfully fetched one or more entitlements, we would throw that into an entitlements event payload.
     # That payload would then be sent over Cloud Pub/Sub for further processing.
-
@@ -0,0 +1,107 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from time import monotonic
+
+
+__all__ = ("ConcurrencyController",)
+
+
+# An adaptive concurrency limiter using additive-increase/multiplicative-decrease (AIMD).
+#
+# Each successful call whose recent mean latency is within the target nudges the limit up by `increase`. A call that is rate-limited (HTTP 429) or pushes the mean latency past the target halves the limit instead.
+#
+# This lets us ramp up to whatever the upstream API can sustain during a burst, without repeatedly slamming it into rate limits.
+#
+# Usage:
+#
+#     async with controller.slot():
+#         await make_request()
+class ConcurrencyController:
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 25,
+        target_latency: float = 1.0,
+        window: int = 20,
+        increase: float = 0.5,
+        decrease: float = 0.5,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.limit: float = initial
+        self.in_flight = 0
+        self.latencies: deque[float] = deque(maxlen=window)
+        # Futures for tasks waiting on a free slot, in arrival order.
+        self._waiters: deque[asyncio.Future] = deque()
+
+    # The current number of calls allowed to run concurrently.
+    @property
+    def concurrency(self) -> int:
+        return max(self.minimum, int(self.limit))
+
+    # The mean latency of the most recent calls, or 0 if no calls have completed yet.
+    @property
+    def mean_latency(self) -> float:
+        if not self.latencies:
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+
+    async def acquire(self):
+        while self.in_flight >= self.concurrency:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                # If we were woken just before being cancelled, pass the wakeup on so the free slot isn't missed.
+                elif not waiter.cancelled():
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    # Releases a slot and adjusts the limit based on the call's latency.
+    #
+    # This is synchronous on purpose: it can't be interrupted by cancellation, so a slot can never leak.
+    def release(self, latency: float, overloaded: bool = False):
+        self.in_flight -= 1
+        self.latencies.append(latency)
+
+        if overloaded or self.mean_latency > self.target_latency:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            # Start a fresh window so a single slow burst doesn't keep halving the limit.
+            self.latencies.clear()
+        else:
+            self.limit = min(self.maximum, self.limit + self.increase)
+
+        self._wake()
+
+    # Wakes as many waiters as there are free slots.
+    def _wake(self):
+        free = self.concurrency - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    # Waits for a free slot, then holds it for the duration of the `async with` block.
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        started = monotonic()
+        overloaded = False
+        try:
+            yield
+        except Exception as e:
+            # Any error carrying an HTTP 429 status (e.g. `stripe.RateLimitError`) is treated as a signal to back off.
+            overloaded = getattr(e, "http_status", None) == 429
+            raise
+        finally:
+            self.release(monotonic() - started, overloaded)
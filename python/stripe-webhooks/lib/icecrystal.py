@@ -1,5 +1,6 @@
 import socket
-from time import time
+from functools import lru_cache
+from time import sleep, time_ns
 from typing import Optional
 
 
@@ -12,10 +13,13 @@ def worker_id_from_parts(parts):
 # If the host has multiple private IP addresses, the first one will be used.
 #
 # If no private IP addresses are found, an exception will be raised.
+#
+# The result is cached, since the host's address won't change and resolving it may require a DNS lookup.
+@lru_cache(maxsize=1)
 def worker_id_from_host():
-    list = socket.getaddrinfo(socket.gethostname(), 8000)
+    addresses = socket.getaddrinfo(socket.gethostname(), 8000)
 
-    for _family, _type, _proto, _cname, addr in list:
+    for _family, _type, _proto, _cname, addr in addresses:
         if len(addr) > 2:
             continue
         (host, _port) = addr  # pyright: ignore [reportAssignmentType]
@@ -28,8 +32,8 @@ def worker_id_from_host():
         if parts[0] == 192:
             if parts[1] == 168:
                 return worker_id_from_parts(parts)
-    else:
-        raise Exception("Could not determine worker ID")
+
+    raise Exception("Could not determine worker ID")
 
 
 # A Snowflake ID is an integer composed of the following parts:
@@ -47,21 +51,23 @@ def worker_id_from_host():
 # Additionally, we can have up to 1024 generators running at the same time (2^10 bits for a worker ID).
 #
 # The timestamp is capable of representation in only 41 bits because we intentionally shift the time based on a selected epoch. This means the timestamp for August 1, 2023 when the selected epoch is January 1, 2020, will only be 113,007,600 milliseconds rather than 1,690,873,200 milliseconds when using the Unix epoch. But this also imposes a limit on the lifespan of the generator by allowing no more than ~70 years of IDs to be generated. For most purposes that is probably sufficient, and before that time comes there should be plenty of opportunity to migrate to a new generator.
-class Snowflake(int):
-    # Returns the *offset* in milliseconds since the epoch.
-    @property
-    def timestamp(self):
-        return self >> 22
+#
+# Snowflake IDs are plain integers. The functions below extract each of the component parts from an ID.
+
+
+# Returns the *offset* in milliseconds since the epoch.
+def snowflake_timestamp(id: int) -> int:
+    return id >> 22
+
+
+# Returns the worker id that generated the Snowflake.
+def snowflake_worker_id(id: int) -> int:
+    return (id >> 12) & 0x3FF
 
-    # Returns the worker id that generated this Snowflake.
-    @property
-    def worker_id(self):
-        return (self >> 12) & 0x3FF
 
-    # Returns the sequence number for this Snowflake.
-    @property
-    def sequence(self):
-        return self & 0xFFF
+# Returns the sequence number for the Snowflake.
+def snowflake_sequence(id: int) -> int:
+    return id & 0xFFF
 
 
 # A Snowflake ID generator.
@@ -84,6 +90,8 @@ class SnowflakeGenerator:
     ):
         self.epoch = epoch
         self.worker_id = self.ensure_worker_id(worker_id)
+        # The worker id never changes, so it is pre-shifted into position once.
+        self._worker_bits = self.worker_id << 12
         self.last_timestamp = start_time
         self.sequence = sequence
 
@@ -94,8 +102,8 @@ class SnowflakeGenerator:
         return worker_id_from_host()
 
     # Generates a new Snowflake ID based on the current state of the generator.
-    def next_id(self):
-        timestamp = int(time() * 1000)
+    def next_id(self) -> int:
+        timestamp = time_ns() // 1_000_000
         if timestamp < self.last_timestamp:
             raise Exception("Clock moved backwards")
         if timestamp == self.last_timestamp:
@@ -105,9 +113,7 @@ class SnowflakeGenerator:
         else:
             self.sequence = 0
         self.last_timestamp = timestamp
-        return Snowflake(
-            ((timestamp - self.epoch) << 22) | (self.worker_id << 12) | self.sequence
-        )
+        return ((timestamp - self.epoch) << 22) | self._worker_bits | self.sequence
 
     # Waits until the next millisecond, then returns the current timestamp.
     #
@@ -115,5 +121,11 @@ class SnowflakeGenerator:
     def wait_for_next_millis(self, timestamp: int):
         # In theory, timestamp should never be less than self.last_timestamp, but let's just err on the side of caution.
         while timestamp <= self.last_timestamp:
-            timestamp = int(time() * 1000)
+            # Sleep until the start of the next millisecond (at most ~1ms) rather than spinning on the clock.
+            now = time_ns()
+            delay = ((self.last_timestamp + 1) * 1_000_000 - now) / 1e9
+            if delay > 0:
+                sleep(delay)
+                now = time_ns()
+            timestamp = now // 1_000_000
         return timestamp
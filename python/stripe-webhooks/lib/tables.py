@@ -1,10 +1,23 @@
 from databases.interfaces import Record
-from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy import (
+    Column,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    literal_column,
+    select,
+)
+from sqlalchemy.dialects.postgresql import insert
 
 
 __all__ = (
     "_WebhookTracker",
     "WebhookTrackers",
+    "SELECT_WEBHOOK_TRACKER",
+    "UPSERT_WEBHOOK_TRACKER",
 )
 
 
@@ -24,4 +37,32 @@ WebhookTrackers: Table = Table(
     Column("event_id", String),
     Column("event_type", String),
     Column("updated", Integer),
+    # Trackers are always looked up (and upserted) by event id + type, so this must be a unique index.
+    # This only describes the schema; the index itself is created by `sql/webhook_trackers_unique_index.sql`.
+    Index("ix_tracker_event", "event_id", "event_type", unique=True),
+)
+
+
+# Webhook tracker statements, expressed with SQLAlchemy core against the table definition above rather than as raw SQL strings.
+#
+# This is for readability and to keep the column names in one place; it has no performance effect. `databases` still binds and compiles the statement on every call, and asyncpg's statement cache already reused the prepared statement for the equivalent raw SQL.
+
+# Fetches the most recent `updated` value for an event's tracker. Bind with `.params(event_id=..., event_type=...)`.
+SELECT_WEBHOOK_TRACKER = select(WebhookTrackers.c.updated).where(
+    WebhookTrackers.c.event_id == bindparam("event_id"),
+    WebhookTrackers.c.event_type == bindparam("event_type"),
+)
+
+# Inserts a tracker, or advances an existing one if the new `updated` value is more recent. Bind with `.values(...)`.
+#
+# Returns a row only if the tracker was inserted or advanced.
+_excluded = insert(WebhookTrackers).excluded
+UPSERT_WEBHOOK_TRACKER = (
+    insert(WebhookTrackers)
+    .on_conflict_do_update(
+        index_elements=[WebhookTrackers.c.event_id, WebhookTrackers.c.event_type],
+        set_={"updated": _excluded.updated},
+        where=WebhookTrackers.c.updated < _excluded.updated,
+    )
+    .returning(literal_column("(xmax = 0)").label("inserted"))
 )
@@ -0,0 +1,31 @@
+-- Adds the unique (event_id, event_type) index on webhook_trackers.
+--
+-- Deploy prerequisite: this must be applied BEFORE deploying the upsert-based webhook tracker
+-- (`Context.increment_webhook_tracker`). Its `ON CONFLICT (event_id, event_type)` clause fails on every webhook
+-- unless this index exists and is valid.
+--
+-- `CREATE INDEX CONCURRENTLY` cannot run inside a transaction block, so run this file statement by statement
+-- (e.g. `psql -f`, without `--single-transaction`).
+--
+-- Recovery: if the index build fails (e.g. the old code wrote a new duplicate between steps 1 and 2), Postgres leaves
+-- behind an INVALID `ix_tracker_event`. An invalid index can't be used by `ON CONFLICT`, so it must be rebuilt. Step 3
+-- reports whether the index is valid; if it returns `false`, run:
+--
+--     DROP INDEX CONCURRENTLY ix_tracker_event;
+--
+-- and then re-run this whole file. Step 2 deliberately has no `IF NOT EXISTS`, so a re-run fails loudly rather than
+-- silently skipping over an invalid index.
+
+-- 1. Remove duplicate trackers, keeping the most recent row for each (event_id, event_type).
+DELETE FROM webhook_trackers a
+USING webhook_trackers b
+WHERE a.event_id = b.event_id
+  AND a.event_type = b.event_type
+  AND (a.updated < b.updated OR (a.updated = b.updated AND a.ctid < b.ctid));
+
+-- 2. Build the unique index without blocking writes.
+CREATE UNIQUE INDEX CONCURRENTLY ix_tracker_event
+    ON webhook_trackers (event_id, event_type);
+
+-- 3. Verify the index is valid. This must return `true` before deploying.
+SELECT indisvalid FROM pg_index WHERE indexrelid = 'ix_tracker_event'::regclass;
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from lib.backpressure import ConcurrencyController
+
+
+class RateLimited(Exception):
+    http_status = 429
+
+
+@pytest.mark.asyncio
+async def test_limit_grows_on_fast_calls():
+    controller = ConcurrencyController(initial=2, target_latency=1.0, increase=0.5)
+
+    for _ in range(3):
+        async with controller.slot():
+            pass
+
+    assert controller.limit == 3.5
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_limit_halves_on_rate_limit():
+    controller = ConcurrencyController(initial=8)
+
+    with pytest.raises(RateLimited):
+        async with controller.slot():
+            raise RateLimited()
+
+    assert controller.limit == 4
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_other_errors_do_not_halve_limit():
+    controller = ConcurrencyController(initial=8, increase=0.5)
+
+    with pytest.raises(ValueError):
+        async with controller.slot():
+            raise ValueError()
+
+    assert controller.limit == 8.5
+
+
+@pytest.mark.asyncio
+async def test_limit_halves_on_latency_overshoot():
+    controller = ConcurrencyController(initial=8, target_latency=1.0)
+
+    await controller.acquire()
+    controller.release(5.0)
+
+    assert controller.limit == 4
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_limit_never_drops_below_minimum():
+    controller = ConcurrencyController(initial=2, minimum=1)
+
+    for _ in range(5):
+        await controller.acquire()
+        controller.release(0.0, overloaded=True)
+
+    assert controller.limit == 1
+    assert controller.concurrency == 1
+
+
+@pytest.mark.asyncio
+async def test_waiters_wake_when_limit_rises():
+    controller = ConcurrencyController(initial=2, increase=1)
+    await controller.acquire()
+    await controller.acquire()
+
+    waiters = [asyncio.create_task(controller.acquire()) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert not any(w.done() for w in waiters)
+
+    # Releasing one slot frees a single slot, but the limit also rises from 2 to 3, so both waiters fit.
+    controller.release(0.0)
+    await asyncio.wait_for(asyncio.gather(*waiters), timeout=1)
+
+    assert controller.concurrency == 3
+    assert controller.in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_leak_slot():
+    controller = ConcurrencyController(initial=1, increase=0)
+    await controller.acquire()
+
+    cancelled = asyncio.create_task(controller.acquire())
+    waiting = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    controller.release(0.0)
+    await asyncio.wait_for(waiting, timeout=1)
+
+    assert cancelled.cancelled()
+    assert controller.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_woken_then_cancelled_waiter_passes_slot_on():
+    controller = ConcurrencyController(initial=1, increase=0)
+    await controller.acquire()
+
+    woken = asyncio.create_task(controller.acquire())
+    waiting = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+
+    # The release wakes the first waiter, which is then cancelled before it can take the slot.
+    controller.release(0.0)
+    woken.cancel()
+    await asyncio.wait_for(waiting, timeout=1)
+
+    assert woken.cancelled()
+    assert controller.in_flight == 1
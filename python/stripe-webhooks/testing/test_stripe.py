@@ -0,0 +1,79 @@
+import hmac
+from hashlib import sha256
+from time import time
+
+import pytest
+import stripe
+
+from lib.stripe import Stripe
+
+
+SECRET = "whsec_test_secret"
+PAYLOAD = '{"id": "evt_123", "type": "invoice.paid"}'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("STRIPE_API_KEY", "sk_test_123")
+    monkeypatch.setenv("STRIPE_WEBHOOK_SECRET", SECRET)
+    return Stripe()
+
+
+def sign(payload: str, timestamp: int, secret: str = SECRET) -> str:
+    return hmac.new(
+        secret.encode("utf-8"), f"{timestamp}.{payload}".encode("utf-8"), sha256
+    ).hexdigest()
+
+
+# Returns whether Stripe's own verifier accepts the header, for comparison.
+def stripe_accepts(payload: str, header: str) -> bool:
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload, header, SECRET, stripe.Webhook.DEFAULT_TOLERANCE
+        )
+    except stripe.error.SignatureVerificationError:
+        return False
+    return True
+
+
+def check(client: Stripe, payload: str, header: str, expected: bool):
+    assert client.verify_signature(header, payload.encode("utf-8")) is expected
+    assert stripe_accepts(payload, header) is expected
+
+
+def test_valid_signature(client):
+    t = int(time())
+    check(client, PAYLOAD, f"t={t},v1={sign(PAYLOAD, t)}", True)
+
+
+def test_tampered_payload(client):
+    t = int(time())
+    tampered = PAYLOAD.replace("evt_123", "evt_456")
+    check(client, tampered, f"t={t},v1={sign(PAYLOAD, t)}", False)
+
+
+def test_multiple_v1_signatures(client):
+    t = int(time())
+    header = f"t={t},v1={sign(PAYLOAD, t, 'whsec_old')},v1={sign(PAYLOAD, t)},v0=abc"
+    check(client, PAYLOAD, header, True)
+
+
+def test_multiple_v1_signatures_none_valid(client):
+    t = int(time())
+    header = f"t={t},v1={sign(PAYLOAD, t, 'whsec_a')},v1={sign(PAYLOAD, t, 'whsec_b')}"
+    check(client, PAYLOAD, header, False)
+
+
+def test_missing_timestamp(client):
+    t = int(time())
+    check(client, PAYLOAD, f"v1={sign(PAYLOAD, t)}", False)
+
+
+def test_missing_v1(client):
+    t = int(time())
+    check(client, PAYLOAD, f"t={t},v0={sign(PAYLOAD, t)}", False)
+
+
+def test_expired_timestamp(client):
+    t = int(time()) - stripe.Webhook.DEFAULT_TOLERANCE - 60
+    check(client, PAYLOAD, f"t={t},v1={sign(PAYLOAD, t)}", False)